@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Shared Audio Capture for AudioPirate
+One ALSA capture thread per device, fanned out to every live stream listener
+"""
+
+import asyncio
+import queue
+import threading
+
+try:
+    import alsaaudio
+    ALSA_AVAILABLE = True
+except ImportError:
+    ALSA_AVAILABLE = False
+
+# Live streams read 20ms periods; 20-40ms keeps latency low without waking
+# the Pi more than it needs to. The ALSA ring buffer holds BUFFER_PERIODS of
+# them, which is the headroom a busy capture thread has before an overrun.
+PERIOD_FRAMES = 960  # 20ms at 48kHz
+BUFFER_PERIODS = 4  # 80ms buffer
+
+
+def open_capture(device, period_size=PERIOD_FRAMES):
+    """
+    Open and configure a capture PCM for live streaming
+    
+    Args:
+        device: ALSA device to try first; falls back to hw:0,0
+        period_size: Frames per read
+    
+    Returns:
+        Configured alsaaudio.PCM (stereo, 48kHz, native 32-bit)
+    """
+    # Pass the hw params to the constructor so they are applied once,
+    # rather than once per setter call
+    params = dict(
+        channels=2,
+        rate=48000,
+        format=alsaaudio.PCM_FORMAT_S32_LE,  # Read native 32-bit format
+        periodsize=period_size,
+        periods=BUFFER_PERIODS,
+    )
+    try:
+        return alsaaudio.PCM(
+            alsaaudio.PCM_CAPTURE,
+            alsaaudio.PCM_NORMAL,
+            device=device,
+            **params
+        )
+    except alsaaudio.ALSAAudioError:
+        print(f"Device '{device}' not found, falling back to 'hw:0,0'")
+        return alsaaudio.PCM(
+            alsaaudio.PCM_CAPTURE,
+            alsaaudio.PCM_NORMAL,
+            device='hw:0,0',
+            **params
+        )
+
+
+class AudioBroker:
+    """
+    Reads a capture device once and hands every period to all listeners
+    
+    The PCM is opened when the first listener subscribes and closed when
+    the last one leaves. Listeners get either a queue.Queue (threads) or an
+    asyncio.Queue (coroutines). A listener that falls behind loses its
+    oldest chunk rather than holding up the others. A None on the queue
+    means capture has stopped.
+    """
+    
+    def __init__(self, device, period_size=PERIOD_FRAMES, maxsize=100):
+        """
+        Args:
+            device: ALSA device to capture from
+            period_size: Frames per read
+            maxsize: Chunks buffered per listener before the oldest is dropped
+        """
+        self.device = device
+        self.period_size = period_size
+        self.maxsize = maxsize
+        self.subscribers = {}  # queue -> (loop or None, transform or None)
+        self.thread = None
+        self._lock = threading.Lock()
+    
+    def subscribe(self, loop=None, transform=None):
+        """
+        Register a listener, opening the PCM if capture isn't running
+        
+        Blocks while the device is opened, so coroutines should call this
+        through an executor.
+        
+        Args:
+            loop: Event loop to deliver on; None for a thread-side queue.Queue
+            transform: Function applied to each raw 32-bit chunk in the
+                capture thread, once per chunk however many listeners share it
+        
+        Returns:
+            asyncio.Queue if loop is given, otherwise queue.Queue
+        
+        Raises:
+            alsaaudio.ALSAAudioError: If the capture device can't be opened
+        """
+        q = asyncio.Queue(maxsize=self.maxsize) if loop else queue.Queue(maxsize=self.maxsize)
+        with self._lock:
+            if self.thread is None:
+                pcm = open_capture(self.device, self.period_size)
+                self.thread = threading.Thread(target=self._run, args=(pcm,), daemon=True)
+                self.thread.start()
+            self.subscribers[q] = (loop, transform)
+        return q
+    
+    def unsubscribe(self, q):
+        """Remove a listener; capture stops after the last one leaves"""
+        with self._lock:
+            loop, _ = self.subscribers.pop(q, (None, None))
+        # Wake anything still blocked on the queue
+        self._deliver(q, loop, None)
+    
+    def _run(self, pcm):
+        """Capture loop (runs in thread)"""
+        try:
+            while True:
+                length, data = pcm.read()
+                if length <= 0:
+                    continue
+                with self._lock:
+                    if not self.subscribers:
+                        # Close before a new subscriber can reopen the device
+                        pcm.close()
+                        self.thread = None
+                        return
+                    subscribers = list(self.subscribers.items())
+                
+                converted = {}
+                for q, (loop, transform) in subscribers:
+                    if transform not in converted:
+                        converted[transform] = transform(data) if transform else data
+                    self._deliver(q, loop, converted[transform])
+        except Exception as e:
+            print(f"Audio capture error: {e}")
+            with self._lock:
+                pcm.close()
+                self.thread = None
+                subscribers = list(self.subscribers.items())
+                self.subscribers = {}
+            for q, (loop, _) in subscribers:
+                self._deliver(q, loop, None)
+    
+    @classmethod
+    def _deliver(cls, q, loop, item):
+        """Hand an item to a listener from any thread"""
+        if loop is None:
+            cls._put(q, item)
+            return
+        try:
+            loop.call_soon_threadsafe(cls._put, q, item)
+        except RuntimeError:
+            pass  # Loop already closed
+    
+    @staticmethod
+    def _put(q, item):
+        """Put without blocking, dropping the oldest chunk if the queue is full"""
+        while True:
+            try:
+                q.put_nowait(item)
+                return
+            except (queue.Full, asyncio.QueueFull):
+                try:
+                    q.get_nowait()
+                except (queue.Empty, asyncio.QueueEmpty):
+                    pass
+
+
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+
+def get_broker(device, period_size=PERIOD_FRAMES):
+    """
+    Return the shared broker for a capture device, creating it on first use
+    
+    Args:
+        device: ALSA device name
+        period_size: Frames per read, used only when the broker is created
+    
+    Returns:
+        AudioBroker for the device
+    """
+    with _brokers_lock:
+        broker = _brokers.get(device)
+        if broker is None:
+            broker = _brokers[device] = AudioBroker(device, period_size)
+        return broker
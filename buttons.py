@@ -4,15 +4,26 @@ Button/GPIO Handler for AudioPirate
 Manages button inputs via GPIO pins
 """
 
+import logging
+
+# Button callbacks run on the GPIO thread, so log lazily instead of printing
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# GPIO backend, chosen once at import: gpiozero, then RPi.GPIO, then mock
 try:
     from gpiozero import Button
-    GPIO_AVAILABLE = True
+    _BACKEND = "gpiozero"
 except ImportError:
-    GPIO_AVAILABLE = False
-    print("Warning: gpiozero not installed. Buttons will run in mock mode.")
+    try:
+        import RPi.GPIO as GPIO
+        _BACKEND = "rpi"
+    except (ImportError, RuntimeError):
+        _BACKEND = "mock"
+        print("Warning: gpiozero/RPi.GPIO not installed. Buttons will run in mock mode.")
 
-import time
-import threading
+GPIO_AVAILABLE = _BACKEND != "mock"
+GPIOZERO_AVAILABLE = _BACKEND == "gpiozero"
 
 
 class ButtonHandler:
@@ -32,6 +43,12 @@ class ButtonHandler:
         "down": "Y",
     }
     
+    # Button name -> friendly name, for O(1) lookup on each press
+    REVERSE_ALIASES = {btn: alias for alias, btn in BUTTON_ALIASES.items()}
+    
+    # Debouncing is done once, by the GPIO library (gpiozero bounce_time or
+    # RPi.GPIO bouncetime): edges within this window of a press are ignored,
+    # so callbacks are not re-checked here
     DEBOUNCE_TIME = 0.2  # 200ms debounce
     
     def __init__(self, callback):
@@ -42,84 +59,64 @@ class ButtonHandler:
             callback: Function to call when button is pressed, receives button name
         """
         self.callback = callback
-        self.last_press_time = {}
         self.mock_mode = not GPIO_AVAILABLE
         self.buttons = {}
         
         if GPIO_AVAILABLE:
             try:
-                # Setup buttons with gpiozero (pull_up=True for active LOW)
-                for button_name, pin in self.BUTTON_PINS.items():
-                    btn = Button(pin, pull_up=True, bounce_time=self.DEBOUNCE_TIME)
-                    btn.when_pressed = lambda b=button_name: self._on_button_event(b)
-                    self.buttons[button_name] = btn
-                    self.last_press_time[button_name] = 0
+                if _BACKEND == "gpiozero":
+                    # Setup buttons with gpiozero (pull_up=True for active LOW)
+                    for button_name, pin in self.BUTTON_PINS.items():
+                        btn = Button(pin, pull_up=True, bounce_time=self.DEBOUNCE_TIME)
+                        btn.when_pressed = lambda b=button_name: self._on_button_event(b)
+                        self.buttons[button_name] = btn
+                else:
+                    # Setup buttons with RPi.GPIO (pull-up, trigger on falling edge)
+                    GPIO.setmode(GPIO.BCM)
+                    for button_name, pin in self.BUTTON_PINS.items():
+                        GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+                        GPIO.add_event_detect(
+                            pin, GPIO.FALLING,
+                            callback=lambda channel, b=button_name: self._on_button_event(b),
+                            bouncetime=int(self.DEBOUNCE_TIME * 1000)
+                        )
+                        self.buttons[button_name] = pin
                     
-                print("Button handler initialized successfully")
+                logger.info("Button handler initialized successfully")
             except Exception as e:
-                print(f"Failed to initialize GPIO: {e}")
-                print("Running in mock mode")
+                logger.warning("Failed to initialize GPIO: %s", e)
+                logger.warning("Running in mock mode")
                 self.mock_mode = True
         
-        # Start mock button thread if needed (for testing on non-Pi systems)
+        # In mock mode, presses can be injected with simulate_button_press()
         if self.mock_mode:
-            print("Button handler running in mock mode")
-            print("Button mapping: B=info, X=up, Y=down")
-            self._start_mock_input()
+            logger.info("Button handler running in mock mode")
+            logger.info("Button mapping: B=info, X=up, Y=down")
             
     def _on_button_event(self, button_name):
-        """Handle button press with debouncing"""
-        current_time = time.time()
-        
-        # Check debounce
-        if current_time - self.last_press_time[button_name] < self.DEBOUNCE_TIME:
-            return
-            
-        self.last_press_time[button_name] = current_time
-        
+        """Handle a (debounced) button press"""
         # Map to friendly name if using aliases
-        friendly_name = button_name
-        for alias, btn in self.BUTTON_ALIASES.items():
-            if btn == button_name:
-                friendly_name = alias
-                break
+        friendly_name = self.REVERSE_ALIASES.get(button_name, button_name)
         
-        print(f"Button pressed: {button_name} ({friendly_name})")
+        logger.debug("Button pressed: %s (%s)", button_name, friendly_name)
         
         # Call the callback with the friendly name
         if self.callback:
             self.callback(friendly_name)
             
-    def _start_mock_input(self):
-        """Start a thread to simulate button presses from keyboard (for testing)"""
-        def input_loop():
-            key_map = {
-                'b': 'info',    # Button B
-                'x': 'up',      # Button X
-                'y': 'down',    # Button Y
-            }
-            
-            try:
-                while True:
-                    # This is a simple implementation - could be enhanced with proper keyboard handling
-                    time.sleep(0.1)
-            except KeyboardInterrupt:
-                pass
-                
-        # Note: In mock mode, you'd typically use a library like 'keyboard' or 'pynput'
-        # For now, this is just a placeholder
-        # threading.Thread(target=input_loop, daemon=True).start()
-        
     def simulate_button_press(self, button_name):
         """Manually trigger a button press (useful for testing)"""
         if button_name in self.BUTTON_PINS:
             self._on_button_event(button_name)
         else:
-            print(f"Unknown button: {button_name}")
+            logger.warning("Unknown button: %s", button_name)
             
     def cleanup(self):
         """Clean up GPIO resources"""
         if GPIO_AVAILABLE and not self.mock_mode:
-            for btn in self.buttons.values():
-                btn.close()
-        print("Button handler cleanup complete")
+            if _BACKEND == "gpiozero":
+                for btn in self.buttons.values():
+                    btn.close()
+            else:
+                GPIO.cleanup(list(self.buttons.values()))
+        logger.info("Button handler cleanup complete")
@@ -4,65 +4,81 @@ Quick check if WebSocket server can start
 Run this on the Pi to diagnose the issue
 """
 
+import os
 import sys
 
-print("Checking WebSocket server...")
-print("-" * 60)
+CERT_FILE = 'certs/cert.pem'
+KEY_FILE = 'certs/key.pem'
 
-# Check websockets library
-try:
-    import websockets
-    print(f"✓ websockets library installed (version {websockets.__version__})")
-except ImportError:
-    print("✗ websockets library NOT installed")
-    print("\nFIX: Run on the Pi:")
-    print("  pip3 install websockets")
-    print("  # or")
-    print("  sudo pip3 install websockets")
-    sys.exit(1)
 
-# Check SSL certificates
-import os
-cert_file = 'certs/cert.pem'
-key_file = 'certs/key.pem'
+def check_websockets_library():
+    """Return True if the websockets library is installed"""
+    try:
+        import websockets
+        print(f"✓ websockets library installed (version {websockets.__version__})")
+        return True
+    except ImportError:
+        print("✗ websockets library NOT installed")
+        print("\nFIX: Run on the Pi:")
+        print("  pip3 install websockets")
+        print("  # or")
+        print("  sudo pip3 install websockets")
+        return False
 
-if os.path.exists(cert_file) and os.path.exists(key_file):
-    print(f"✓ SSL certificates found in certs/")
-else:
-    print(f"⚠ SSL certificates NOT found")
-    print(f"  Expected: {cert_file} and {key_file}")
-    print("  The web server should create these automatically")
 
-# Try to start WebSocket server
-print("\nTrying to start WebSocket server...")
-try:
-    from ws_audio_server import AudioWebSocketServer
-    import asyncio
-    import signal
-    
-    server = AudioWebSocketServer(port=8765, password='audiopirate', use_ssl=True)
-    
-    async def test_start():
-        await server.start()
-    
-    print("Starting server (press Ctrl+C to stop)...")
-    print("-" * 60)
+def check_certificates():
+    """Report whether the SSL certificates exist"""
+    if os.path.exists(CERT_FILE) and os.path.exists(KEY_FILE):
+        print(f"✓ SSL certificates found in certs/")
+    else:
+        print(f"⚠ SSL certificates NOT found")
+        print(f"  Expected: {CERT_FILE} and {KEY_FILE}")
+        print("  The web server should create these automatically")
+
+
+def run_server():
+    """
+    Start the WebSocket server and run until Ctrl+C
     
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    Returns:
+        Exit code: 0 on a clean stop, 1 if the server failed to start
+    """
+    print("\nTrying to start WebSocket server...")
+    try:
+        from ws_audio_server import AudioWebSocketServer
+        import asyncio
+        
+        server = AudioWebSocketServer(port=8765, password='audiopirate', use_ssl=True)
+        
+        print("Starting server (press Ctrl+C to stop)...")
+        print("-" * 60)
+        
+        # asyncio.run cancels the server task and closes the loop on Ctrl+C
+        asyncio.run(server.start())
+        return 0
     
-    def signal_handler(sig, frame):
+    except KeyboardInterrupt:
         print("\n\nStopping server...")
-        loop.stop()
-        sys.exit(0)
-    
-    signal.signal(signal.SIGINT, signal_handler)
+        return 0
+    except Exception as e:
+        print(f"\n✗ Error starting server: {e}")
+        import traceback
+        traceback.print_exc()
+        print("\nThis is the error preventing the WebSocket server from starting.")
+        return 1
+
+
+def main():
+    """Run the checks and start the server; returns the exit code"""
+    print("Checking WebSocket server...")
+    print("-" * 60)
     
-    loop.run_until_complete(test_start())
+    if not check_websockets_library():
+        return 1
     
-except Exception as e:
-    print(f"\n✗ Error starting server: {e}")
-    import traceback
-    traceback.print_exc()
-    print("\nThis is the error preventing the WebSocket server from starting.")
-    sys.exit(1)
+    check_certificates()
+    return run_server()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,23 +2,19 @@
 """
 AudioPirate Diagnostic Tool
 Checks if all dependencies are installed and services can start
+
+Library checks only look packages up; pass --deep to also import and
+create the AudioPirate components (which touches GPIO, SPI and ALSA).
 """
 
 import sys
+import argparse
+from importlib.util import find_spec
+from importlib.metadata import version, PackageNotFoundError
 
-print("=" * 60)
-print("AudioPirate Diagnostic Tool")
-print("=" * 60)
-
-# Check Python version
-print(f"\n1. Python Version: {sys.version}")
-if sys.version_info < (3, 7):
-    print("   ⚠ WARNING: Python 3.7+ recommended")
-
-# Check required libraries
-print("\n2. Checking Python Libraries:")
-libraries = {
+LIBRARIES = {
     'websockets': 'WebSocket streaming',
+    'aiohttp': 'Async web server',
     'alsaaudio': 'Audio recording (Pi only)',
     'cryptography': 'HTTPS certificates',
     'PIL': 'Display graphics',
@@ -26,97 +22,190 @@ libraries = {
     'ST7789': 'Display driver (Pi only)',
 }
 
-missing = []
-for lib, description in libraries.items():
+# Libraries AudioPirate runs without (slower fallbacks); reported but not counted as missing
+OPTIONAL = {
+    'aiohttp',  # Web UI falls back to the threaded http.server
+}
+
+# pip distribution names where they differ from the import name
+DISTRIBUTIONS = {
+    'alsaaudio': 'pyalsaaudio',
+    'PIL': 'Pillow',
+}
+
+
+def check_library(name):
+    """Return True if the module can be found, without importing it"""
+    return find_spec(name) is not None
+
+
+def _safe_version(name):
+    """Return the installed version of a library, or '?' if it has no metadata"""
     try:
-        if lib == 'PIL':
-            __import__('PIL')
-        else:
-            __import__(lib)
-        print(f"   ✓ {lib:15} - {description}")
-    except ImportError:
-        print(f"   ✗ {lib:15} - {description} [MISSING]")
-        missing.append(lib)
-
-# Check WebSocket server
-print("\n3. WebSocket Server Test:")
-try:
-    from ws_audio_server import AudioWebSocketServer
-    server = AudioWebSocketServer(port=8765, password='test')
-    print("   ✓ WebSocket server can be created")
+        return version(DISTRIBUTIONS.get(name, name))
+    except PackageNotFoundError:
+        return '?'
+
+
+def check_python_version():
+    """Print the Python version and warn if it is too old"""
+    print(f"\n1. Python Version: {sys.version}")
+    if sys.version_info < (3, 7):
+        print("   ⚠ WARNING: Python 3.7+ recommended")
+
+
+def check_libraries():
+    """
+    Check the required libraries are installed
     
-    # Check if websockets is available
-    from ws_audio_server import WEBSOCKETS_AVAILABLE
-    if WEBSOCKETS_AVAILABLE:
-        print("   ✓ websockets library loaded")
-    else:
-        print("   ✗ websockets library NOT available")
-        missing.append('websockets')
-except Exception as e:
-    print(f"   ✗ WebSocket server error: {e}")
-
-# Check HTTPS server
-print("\n4. HTTPS Web Server Test:")
-try:
-    from web_server import WebServer
-    web = WebServer(directory="recordings", port=8000, use_ssl=True)
-    print("   ✓ Web server can be created")
-except Exception as e:
-    print(f"   ✗ Web server error: {e}")
-
-# Check audio recorder
-print("\n5. Audio Recorder Test:")
-try:
-    from audio_recorder import AudioRecorder, ALSA_AVAILABLE
-    recorder = AudioRecorder()
-    if ALSA_AVAILABLE:
-        print("   ✓ ALSA audio available")
-    else:
-        print("   ⚠ ALSA not available (mock mode)")
-except Exception as e:
-    print(f"   ✗ Audio recorder error: {e}")
-
-# Check display
-print("\n6. Display Test:")
-try:
-    from display import Display, DISPLAY_AVAILABLE
-    display = Display()
-    if DISPLAY_AVAILABLE:
-        print("   ✓ ST7789 display available")
+    Returns:
+        List of missing library names
+    """
+    rows = []
+    for lib, description in LIBRARIES.items():
+        # find_spec locates the package without running its import-time hardware probes
+        present = check_library(lib)
+        rows.append((lib, _safe_version(lib) if present else '-', description, present))
+    
+    # Write the whole table at once rather than one print per library
+    sys.stdout.write("\n2. Checking Python Libraries:\n" + "\n".join(
+        f"   {'✓' if present else '⚠' if lib in OPTIONAL else '✗'} {lib:15} {ver:10} - {description}"
+        f"{'' if present else f' [OPTIONAL: pip3 install {lib}]' if lib in OPTIONAL else ' [MISSING]'}"
+        for lib, ver, description, present in rows
+    ) + "\n")
+    return [lib for lib, _, _, present in rows if not present and lib not in OPTIONAL]
+
+
+def check_websocket_server(missing):
+    """Check the WebSocket server can be created, adding websockets to missing if not"""
+    print("\n3. WebSocket Server Test:")
+    try:
+        from ws_audio_server import AudioWebSocketServer
+        server = AudioWebSocketServer(port=8765, password='test')
+        print("   ✓ WebSocket server can be created")
+        
+        # Check if websockets is available
+        from ws_audio_server import WEBSOCKETS_AVAILABLE
+        if WEBSOCKETS_AVAILABLE:
+            print("   ✓ websockets library loaded")
+        else:
+            print("   ✗ websockets library NOT available")
+            if 'websockets' not in missing:
+                missing.append('websockets')
+    except Exception as e:
+        print(f"   ✗ WebSocket server error: {e}")
+
+
+def check_web_server():
+    """Check the HTTPS web server can be created"""
+    print("\n4. HTTPS Web Server Test:")
+    try:
+        from web_server import WebServer
+        web = WebServer(directory="recordings", port=8000, use_ssl=True)
+        print("   ✓ Web server can be created")
+    except Exception as e:
+        print(f"   ✗ Web server error: {e}")
+
+
+def check_recorder():
+    """Check the audio recorder can be created"""
+    print("\n5. Audio Recorder Test:")
+    try:
+        from audio_recorder import AudioRecorder, ALSA_AVAILABLE
+        recorder = AudioRecorder()
+        if ALSA_AVAILABLE:
+            print("   ✓ ALSA audio available")
+        else:
+            print("   ⚠ ALSA not available (mock mode)")
+    except Exception as e:
+        print(f"   ✗ Audio recorder error: {e}")
+
+
+def check_display():
+    """Check the display can be created"""
+    print("\n6. Display Test:")
+    try:
+        from display import Display, DISPLAY_AVAILABLE
+        display = Display()
+        if DISPLAY_AVAILABLE:
+            print("   ✓ ST7789 display available")
+        else:
+            print("   ⚠ Display not available (mock mode)")
+    except Exception as e:
+        print(f"   ✗ Display error: {e}")
+
+
+def check_buttons():
+    """Check a button backend is available"""
+    print("\n7. Button Controls Test:")
+    try:
+        from buttons import ButtonHandler, GPIOZERO_AVAILABLE
+        # Don't actually create buttons (might fail without hardware)
+        if GPIOZERO_AVAILABLE:
+            print("   ✓ gpiozero available")
+        else:
+            print("   ⚠ gpiozero not available (mock mode)")
+    except Exception as e:
+        print(f"   ✗ Button handler error: {e}")
+
+
+def print_summary(missing):
+    """Print what is missing and how to install it"""
+    print("\n" + "=" * 60)
+    if missing:
+        print(f"ISSUES FOUND: {len(missing)} missing libraries")
+        print("\nTo fix, run:")
+        if 'websockets' in missing:
+            print("  pip3 install websockets")
+        if 'cryptography' in missing:
+            print("  pip3 install cryptography")
+        if 'PIL' in missing:
+            print("  pip3 install Pillow")
+        print("\nOr install all:")
+        print("  pip3 install -r requirements.txt")
+        print("  ./install_deps.sh")
     else:
-        print("   ⚠ Display not available (mock mode)")
-except Exception as e:
-    print(f"   ✗ Display error: {e}")
-
-# Check buttons
-print("\n7. Button Controls Test:")
-try:
-    from buttons import ButtonHandler, GPIOZERO_AVAILABLE
-    # Don't actually create buttons (might fail without hardware)
-    if GPIOZERO_AVAILABLE:
-        print("   ✓ gpiozero available")
+        print("✓ All required libraries installed!")
+        print("\nYou can start AudioPirate:")
+        print("  python3 main.py")
+    
+    print("=" * 60)
+
+
+def main(argv=None):
+    """
+    Run the diagnostics
+    
+    Args:
+        argv: Command line arguments (defaults to sys.argv[1:])
+    
+    Returns:
+        Exit code: 0 if everything is installed, 1 otherwise
+    """
+    parser = argparse.ArgumentParser(description="AudioPirate Diagnostic Tool")
+    parser.add_argument('--deep', action='store_true',
+                        help="also import and create the servers, recorder and display")
+    args = parser.parse_args(argv)
+    
+    print("=" * 60)
+    print("AudioPirate Diagnostic Tool")
+    print("=" * 60)
+    
+    check_python_version()
+    missing = check_libraries()
+    
+    if args.deep:
+        check_websocket_server(missing)
+        check_web_server()
+        check_recorder()
+        check_display()
+        check_buttons()
     else:
-        print("   ⚠ gpiozero not available (mock mode)")
-except Exception as e:
-    print(f"   ✗ Button handler error: {e}")
-
-# Summary
-print("\n" + "=" * 60)
-if missing:
-    print(f"ISSUES FOUND: {len(missing)} missing libraries")
-    print("\nTo fix, run:")
-    if 'websockets' in missing:
-        print("  pip3 install websockets")
-    if 'cryptography' in missing:
-        print("  pip3 install cryptography")
-    if 'PIL' in missing:
-        print("  pip3 install Pillow")
-    print("\nOr install all:")
-    print("  pip3 install -r requirements.txt")
-    print("  ./install_deps.sh")
-else:
-    print("✓ All required libraries installed!")
-    print("\nYou can start AudioPirate:")
-    print("  python3 main.py")
-
-print("=" * 60)
+        print("\n3-7. Component tests skipped (run with --deep to create them)")
+    
+    print_summary(missing)
+    return 1 if missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,25 +5,121 @@ Supports ST7789 SPI display (240x240)
 """
 
 import time
+import queue
+import logging
+import threading
+from collections import OrderedDict
+from itertools import islice
 
 try:
     import ST7789
-    from PIL import Image, ImageDraw, ImageFont
+    import numpy as np
+    from PIL import Image, ImageChops, ImageDraw, ImageFont
     DISPLAY_AVAILABLE = True
 except ImportError:
     DISPLAY_AVAILABLE = False
     print("Warning: ST7789 library not installed. Display will run in mock mode.")
 
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+SPIDEV_BUFSIZ_PATH = "/sys/module/spidev/parameters/bufsiz"
+
+
+def _read_spidev_bufsiz():
+    """Return spidev's per-transfer buffer size in bytes, or None if it can't be read"""
+    try:
+        with open(SPIDEV_BUFSIZ_PATH) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _pack_rgb565_kernel(src, dst):
+        """Single-pass RGB888 -> big-endian RGB565; dst is (rows, cols * 2) uint8"""
+        for y in range(src.shape[0]):
+            for x in range(src.shape[1]):
+                r = src[y, x, 0]
+                g = src[y, x, 1]
+                b = src[y, x, 2]
+                dst[y, 2 * x] = (r & 0xF8) | (g >> 5)
+                dst[y, 2 * x + 1] = ((g & 0x1C) << 3) | (b >> 3)
+
+
+class CachedFont:
+    """Font wrapper that rasterizes each string once and pastes the cached mask afterwards"""
+    
+    def __init__(self, font, cache_size=128):
+        """
+        Args:
+            font: Loaded PIL font (TrueType or bitmap)
+            cache_size: Number of rendered strings to keep
+        """
+        self.font = font
+        self.cache_size = cache_size
+        self._glyph_cache = OrderedDict()  # text -> (mask, x offset, y offset)
+        
+    def render(self, text):
+        """
+        Get the rendered mask for text
+        
+        Returns:
+            Tuple of (L mode mask, x offset, y offset) relative to the draw position
+        """
+        entry = self._glyph_cache.get(text)
+        if entry is not None:
+            self._glyph_cache.move_to_end(text)
+            return entry
+        
+        # Rasterize straight from the font, skipping ImageDraw's layout pass
+        try:
+            core, (left, top) = self.font.getmask2(text, 'L')
+        except AttributeError:
+            core, left, top = self.font.getmask(text, 'L'), 0, 0  # Bitmap fonts
+        entry = (Image.Image()._new(core), left, top)
+        self._glyph_cache[text] = entry
+        if len(self._glyph_cache) > self.cache_size:
+            self._glyph_cache.popitem(last=False)
+        return entry
+        
+    def render_to(self, image, xy, text, fill):
+        """Draw text onto image like ImageDraw.text, using the cached mask"""
+        mask, left, top = self.render(text)
+        image.paste(fill, (xy[0] + left, xy[1] + top), mask)
+
 
 class Display:
     def __init__(self, width=240, height=240):
         self.width = width
         self.height = height
+        self.rotation = 90
         self.device = None
         self.image = None
-        self.draw = None
+        self._prev_image = None  # Copy of what the panel currently shows (flush thread only)
+        self._frames = queue.Queue(maxsize=1)  # Finished frames waiting for the flush thread
+        self.flush_thread = None
+        self.spi_thread = None
+        self.stripe_rows = 40  # Panel rows per SPI transfer; the next stripe is packed while one is sent
+        self._stripes = queue.Queue(maxsize=1)  # (window, buffer, data) waiting for the SPI thread
+        self._free_stripes = queue.SimpleQueue()  # Stripe buffers ready to be packed into
+        self._writebytes2 = None  # spidev writebytes2, if the driver's SPI handle has it
         self.backlight_on = True
-        self.last_activity = time.time()
+        self._last_frame = None  # Key of the last frame sent to the device
+        self._lock = threading.Lock()  # Serializes drawing into the frame buffer
+        self._status_templates = {}  # (line1, line2) -> pre-rendered status background
+        self._meter_span = width - 20  # Bar width at 100%
+        self._meter_colors = ((0, 255, 0), (255, 255, 0), (255, 0, 0))  # <80, <95, >=95
+        self._menu_colors = ((200, 200, 200), (255, 255, 0))  # Item text: normal, selected
+        self._menu_highlight = ((100, 100, 200), (50, 50, 150))  # Selection: outline, fill
+        self.last_activity = time.monotonic()
         self.timeout_seconds = 20
         
         if DISPLAY_AVAILABLE:
@@ -34,14 +130,31 @@ class Display:
                     cs=1,
                     dc=9,
                     backlight=13,
-                    rotation=90,
+                    rotation=self.rotation,
                     spi_speed_hz=80 * 1000 * 1000
                 )
                 self.device.begin()
+                self._writebytes2 = getattr(getattr(self.device, '_spi', None), 'writebytes2', None)
+                
+                # writebytes2 splits anything larger than spidev's bufsiz (4096 by default)
+                # into several ioctls; a full stripe should go out in one
+                bufsiz = _read_spidev_bufsiz()
+                if self._writebytes2 and bufsiz is not None and bufsiz < self.stripe_rows * max(width, height) * 2:
+                    print(f"Warning: spidev bufsiz is {bufsiz} bytes; add spidev.bufsiz=131072 to "
+                          f"/boot/cmdline.txt for single-transfer display updates")
+                
+                # Persistent RGB565 buffers, sized for one stripe of the longest panel side.
+                # Three stripe buffers: one on the bus, one queued, one being packed.
+                stripe_pixels = self.stripe_rows * max(width, height)
+                for _ in range(3):
+                    self._free_stripes.put(bytearray(stripe_pixels * 2))
+                self._pack_acc = np.empty(stripe_pixels, dtype=np.uint16)
+                self._pack_tmp = np.empty(stripe_pixels, dtype=np.uint16)
                 
                 # Create image buffer
                 self.image = Image.new('RGB', (width, height), color=(0, 0, 0))
-                self.draw = ImageDraw.Draw(self.image)
+                # Solid black frame; pasting an image is a straight copy rather than a fill
+                self._blank = Image.new('RGB', (width, height), color=(0, 0, 0))
                 
                 # Load font - try multiple paths
                 self.font = None
@@ -66,7 +179,31 @@ class Display:
                     print("WARNING: Could not load TrueType fonts, using default (will be tiny)")
                     self.font = ImageFont.load_default()
                     self.font_small = ImageFont.load_default()
+                
+                # Both sizes render through a mask cache; keep these instances for the app's lifetime
+                self.font = CachedFont(self.font)
+                self.font_small = CachedFont(self.font_small)
+                
+                # (font, colour, line height) for each show_status line
+                self._status_styles = (
+                    (self.font, (255, 255, 255), 40),
+                    (self.font_small, (200, 200, 200), 35),
+                    (self.font_small, (200, 200, 200), 35),
+                    (self.font_small, (200, 200, 200), 35),
+                )
+                
+                # Static part of the recording screen: title and empty meter outline
+                self._meter_bg = self._blank.copy()
+                self.font.render_to(self._meter_bg, (10, 30), "RECORDING", (255, 0, 0))
+                ImageDraw.Draw(self._meter_bg).rectangle([(10, 120), (width - 10, 180)], outline=(100, 100, 100), fill=(0, 0, 0))
                     
+                # Frames are diffed and packed on one thread and sent over SPI on another,
+                # so drawing never waits on the bus
+                self.flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+                self.flush_thread.start()
+                self.spi_thread = threading.Thread(target=self._spi_loop, daemon=True)
+                self.spi_thread.start()
+                
                 print("ST7789 display initialized successfully")
             except Exception as e:
                 print(f"Failed to initialize display: {e}")
@@ -75,98 +212,251 @@ class Display:
         else:
             print("Running display in mock mode")
             
+    def _frame_unchanged(self, key):
+        """Return True if key matches the frame on screen, otherwise remember it"""
+        if key == self._last_frame:
+            return True
+        self._last_frame = key
+        return False
+    
+    def _pack_rgb565(self, pixels, out):
+        """
+        Pack RGB888 pixels into big-endian RGB565
+        
+        Args:
+            pixels: (rows, cols, 3) uint8 array, already in panel orientation
+            out: bytearray to pack into
+            
+        Returns:
+            memoryview of the packed bytes in out
+        """
+        rows, cols = pixels.shape[:2]
+        n = rows * cols
+        if NUMBA_AVAILABLE:
+            # Compiled on the first flush, then one fused pass per window
+            _pack_rgb565_kernel(pixels, np.frombuffer(out, dtype=np.uint8, count=n * 2).reshape(rows, cols * 2))
+            return memoryview(out)[:n * 2]
+        
+        acc = self._pack_acc[:n].reshape(rows, cols)
+        tmp = self._pack_tmp[:n].reshape(rows, cols)
+        
+        np.copyto(acc, pixels[..., 0])
+        acc &= 0xF8
+        acc <<= 8
+        np.copyto(tmp, pixels[..., 1])
+        tmp &= 0xFC
+        tmp <<= 3
+        acc |= tmp
+        np.copyto(tmp, pixels[..., 2])
+        tmp >>= 3
+        acc |= tmp
+        
+        # Byte-swap straight into the output buffer
+        np.copyto(np.frombuffer(out, dtype='>u2', count=n).reshape(rows, cols), acc)
+        return memoryview(out)[:n * 2]
+    
+    def _display_region(self, image, box):
+        """Send only the pixels inside box (x0, y0, x1, y1) to the panel
+        
+        Args:
+            image: Frame to take the pixels from
+            box: Region of the frame to push, with exclusive x1/y1
+        """
+        x0, y0, x1, y1 = box
+        k = (self.rotation // 90) % 4
+        
+        # Rotate the crop exactly as ST7789.display() rotates the whole frame
+        pixels = np.rot90(np.asarray(image.crop(box)), k)
+        
+        # Map the image-space box onto panel rows and columns
+        w, h = self.width, self.height
+        r0, r1, c0, c1 = (
+            (y0, y1, x0, x1),
+            (w - x1, w - x0, y0, y1),
+            (h - y1, h - y0, w - x1, w - x0),
+            (x0, x1, h - y1, h - y0),
+        )[k]
+        
+        # Pack stripe by stripe; the SPI thread sends each one while the next is packed
+        for top in range(0, r1 - r0, self.stripe_rows):
+            stripe = pixels[top:top + self.stripe_rows]
+            buf = self._free_stripes.get()
+            data = self._pack_rgb565(stripe, buf)
+            self._stripes.put(((c0, r0 + top, c1 - 1, r0 + top + len(stripe) - 1), buf, data))
+    
+    def _flush(self):
+        """Hand the finished frame to the flush thread, replacing any frame still waiting"""
+        # The copy is the front buffer; drawing carries on in self.image
+        frame = self.image.copy()
+        try:
+            self._frames.get_nowait()
+        except queue.Empty:
+            pass
+        self._frames.put_nowait(frame)
+    
+    def _flush_loop(self):
+        """Send frames to the panel until a None sentinel arrives"""
+        while True:
+            frame = self._frames.get()
+            if frame is None:
+                break
+            try:
+                self._send_frame(frame)
+            except Exception as e:
+                print(f"Display flush error: {e}")
+        self._stripes.put(None)
+    
+    def _spi_loop(self):
+        """Send packed stripes to the panel until a None sentinel arrives"""
+        while True:
+            item = self._stripes.get()
+            if item is None:
+                break
+            window, buf, data = item
+            try:
+                self.device.set_window(*window)
+                if self._writebytes2:
+                    # One spidev call per stripe instead of 4 KB xfer() chunks
+                    self.device.send([], True)  # Raise D/C for pixel data
+                    self._writebytes2(data)
+                else:
+                    self.device.data(list(data))
+            except Exception as e:
+                print(f"Display SPI error: {e}")
+            finally:
+                self._free_stripes.put(buf)
+    
+    def _send_frame(self, frame):
+        """Send only the pixels that changed since the last frame to the panel"""
+        if self._prev_image is not None:
+            bbox = ImageChops.difference(frame, self._prev_image).getbbox()
+        else:
+            # Panel contents are unknown until the first full frame
+            bbox = (0, 0, self.width, self.height)
+        if bbox is not None:
+            self._display_region(frame, bbox)
+        self._prev_image = frame
+            
     def clear(self):
         """Clear the display"""
         if self.device:
-            self.image.paste((0, 0, 0), [0, 0, self.width, self.height])
-            self.device.display(self.image)
-        else:
-            print("[DISPLAY] Clear")
+            with self._lock:
+                if self._frame_unchanged(('clear',)):
+                    return
+                self.image.paste(self._blank)
+                self._flush()
+        elif not self._frame_unchanged(('clear',)):
+            logger.debug("[DISPLAY] Clear")
             
     def show_message(self, message, duration=None):
         """Show a single message on the display"""
         if self.device:
-            self.image.paste((0, 0, 0), [0, 0, self.width, self.height])
-            self.draw.text((10, 90), message, fill=(255, 255, 255), font=self.font)
-            self.device.display(self.image)
-        else:
-            print(f"[DISPLAY] {message}")
+            with self._lock:
+                if self._frame_unchanged(('message', message)):
+                    return
+                self.image.paste(self._blank)
+                self.font.render_to(self.image, (10, 90), message, (255, 255, 255))
+                self._flush()
+        elif not self._frame_unchanged(('message', message)):
+            logger.debug("[DISPLAY] %s", message)
             
     def show_status(self, line1="", line2="", line3="", line4=""):
         """Show multiple lines of status information"""
         if self.device:
-            self.image.paste((0, 0, 0), [0, 0, self.width, self.height])
-            y_offset = 30
-            
-            if line1:
-                self.draw.text((10, y_offset), line1, fill=(255, 255, 255), font=self.font)
-                y_offset += 40
-            if line2:
-                self.draw.text((10, y_offset), line2, fill=(200, 200, 200), font=self.font_small)
-                y_offset += 35
-            if line3:
-                self.draw.text((10, y_offset), line3, fill=(200, 200, 200), font=self.font_small)
-                y_offset += 35
-            if line4:
-                self.draw.text((10, y_offset), line4, fill=(200, 200, 200), font=self.font_small)
-            
-            self.device.display(self.image)
-        else:
-            print(f"[DISPLAY] {line1} | {line2} | {line3} | {line4}")
+            with self._lock:
+                if self._frame_unchanged(('status', line1, line2, line3, line4)):
+                    return
+                # The first two lines rarely change, so keep them pre-rendered
+                template = self._status_templates.get((line1, line2))
+                if template is None:
+                    template = self._blank.copy()
+                    y_offset = 30
+                    for line, (font, fill, line_height) in zip((line1, line2), self._status_styles):
+                        if line:
+                            font.render_to(template, (10, y_offset), line, fill)
+                            y_offset += line_height
+                    if len(self._status_templates) >= 8:
+                        self._status_templates.clear()
+                    self._status_templates[(line1, line2)] = template
+                self.image.paste(template)
+                
+                y_offset = 30 + sum(style[2] for line, style in zip((line1, line2), self._status_styles) if line)
+                for line, (font, fill, line_height) in zip((line3, line4), self._status_styles[2:]):
+                    if line:
+                        font.render_to(self.image, (10, y_offset), line, fill)
+                        y_offset += line_height
+                
+                self._flush()
+        elif not self._frame_unchanged(('status', line1, line2, line3, line4)):
+            logger.debug("[DISPLAY] %s | %s | %s | %s", line1, line2, line3, line4)
             
     def show_recording_level(self, level):
         """Show audio level meter during recording"""
+        # Compare on what is drawn (bar pixels and colour), not the raw level
+        bar_width = int(self._meter_span * (level / 100.0))
+        color = self._meter_colors[(level >= 80) + (level >= 95)]
         if self.device:
-            self.image.paste((0, 0, 0), [0, 0, self.width, self.height])
-            
-            # Draw title
-            self.draw.text((10, 30), "RECORDING", fill=(255, 0, 0), font=self.font)
-            
-            # Draw level meter (0-100)
-            bar_width = int((self.width - 20) * (level / 100.0))
-            self.draw.rectangle([(10, 120), (self.width - 10, 180)], outline=(100, 100, 100), fill=(0, 0, 0))
-            if bar_width > 0:
-                color = (0, 255, 0) if level < 80 else (255, 255, 0) if level < 95 else (255, 0, 0)
-                self.draw.rectangle([(10, 120), (10 + bar_width, 180)], fill=color)
-            
-            self.device.display(self.image)
-        else:
-            bar = "█" * int(level / 5)
-            print(f"[DISPLAY] REC: [{bar:<20}] {level}%")
+            with self._lock:
+                if self._frame_unchanged(('level', bar_width, color)):
+                    return
+                # Title and meter outline come from the template; only the bar is drawn
+                self.image.paste(self._meter_bg)
+                
+                # Draw level meter (0-100)
+                if bar_width > 0:
+                    self.image.paste(color, (10, 120, 11 + bar_width, 181))
+                
+                self._flush()
+        elif not self._frame_unchanged(('level', bar_width, color)):
+            logger.debug("[DISPLAY] REC: [%-20s] %s%%", "█" * int(level / 5), level)
             
     def show_menu(self, items, selected_index=0):
         """Show a menu with selectable items"""
+        items = tuple(islice(items, 6))  # Show up to 6 items on larger display
         if self.device:
-            self.image.paste((0, 0, 0), [0, 0, self.width, self.height])
-            y_offset = 20
-            line_height = 35
-            
-            for i, item in enumerate(items[:6]):  # Show up to 6 items on larger display
-                if i == selected_index:
-                    # Highlight selected item
-                    self.draw.rectangle([(5, y_offset - 2), (self.width - 5, y_offset + 28)], 
-                                      fill=(50, 50, 150), outline=(100, 100, 200))
-                    color = (255, 255, 0)
-                else:
-                    color = (200, 200, 200)
-                    
-                self.draw.text((15, y_offset), item, fill=color, font=self.font_small)
-                y_offset += line_height
-            
-            self.device.display(self.image)
-        else:
-            for i, item in enumerate(items[:6]):
-                prefix = "> " if i == selected_index else "  "
-                print(f"[DISPLAY] {prefix}{item}")
+            with self._lock:
+                if self._frame_unchanged(('menu', items, selected_index)):
+                    return
+                self.image.paste(self._blank)
+                y_offset = 20
+                line_height = 35
+                
+                for i, item in enumerate(items):
+                    selected = i == selected_index
+                    if selected:
+                        # Highlight selected item: 1px outline, then the fill inside it
+                        outline, fill = self._menu_highlight
+                        self.image.paste(outline, (5, y_offset - 2, self.width - 4, y_offset + 29))
+                        self.image.paste(fill, (6, y_offset - 1, self.width - 5, y_offset + 28))
+                        
+                    self.font_small.render_to(self.image, (15, y_offset), item, self._menu_colors[selected])
+                    y_offset += line_height
+                
+                self._flush()
+        elif not self._frame_unchanged(('menu', items, selected_index)):
+            for i, item in enumerate(items):
+                logger.debug("[DISPLAY] %s%s", "> " if i == selected_index else "  ", item)
                 
     def cleanup(self):
         """Clean up display resources"""
+        self.clear()
+        if self.flush_thread:
+            # Let the last frame reach the panel, then stop the flush thread
+            self._frames.put(None)
+            self.flush_thread.join(timeout=2.0)
+            self.flush_thread = None
+        if self.spi_thread:
+            self.spi_thread.join(timeout=2.0)
+            self.spi_thread = None
+        self.set_backlight(False)
+        print("Display cleanup complete")
     
     def set_backlight(self, state):
         """Turn backlight on or off"""
         if self.device:
             try:
-                self.device.set_backlight(1 if state else 0)
+                with self._lock:
+                    self.device.set_backlight(1 if state else 0)
                 self.backlight_on = state
                 if state:
                     print("Display backlight ON")
@@ -176,19 +466,24 @@ class Display:
                 print(f"Backlight control error: {e}")
         else:
             print(f"[MOCK] Backlight: {'ON' if state else 'OFF'}")
+            self.backlight_on = state
     
     def reset_timeout(self):
         """Reset the inactivity timer"""
-        self.last_activity = time.time()
+        self.last_activity = time.monotonic()
         if not self.backlight_on:
             self.set_backlight(True)
     
-    def check_timeout(self):
-        """Check if screen should timeout and disable backlight"""
-        if self.backlight_on and (time.time() - self.last_activity) > self.timeout_seconds:
+    def check_timeout(self, now=None):
+        """
+        Check if screen should timeout and disable backlight
+        
+        Args:
+            now: Current time.monotonic() reading, if the caller already has one
+        """
+        if now is None:
+            now = time.monotonic()
+        if self.backlight_on and (now - self.last_activity) > self.timeout_seconds:
             self.set_backlight(False)
             return True
         return False
-        if self.device:
-            self.clear()
-        print("Display cleanup complete")
@@ -5,9 +5,12 @@ Raspberry Pi Zero 2 W + AudioPirate Board
 """
 
 import time
-import threading
 import json
-import urllib.request
+import logging
+import logging.handlers
+import queue
+import threading
+import http.client
 from display import Display
 from buttons import ButtonHandler
 from audio_recorder import AudioRecorder
@@ -15,6 +18,12 @@ from web_server import WebServer
 from ws_audio_server import AudioWebSocketServer
 import asyncio
 
+try:
+    import uvloop
+    UVLOOP_AVAILABLE = True
+except ImportError:
+    UVLOOP_AVAILABLE = False
+
 
 class AudioPirateApp:
     def __init__(self):
@@ -31,10 +40,21 @@ class AudioPirateApp:
         self.ws_server = AudioWebSocketServer(port=8765, password='audiopirate', use_ssl=False, audio_device='hw:0,0')
         
         # App state
-        self.ngrok_url = None
+        self.ngrok_url = None  # Last URL read from the ngrok API
+        self._ngrok_fetched_at = 0.0  # time.monotonic() of that read
+        self.ngrok_cache_ttl = 60  # Seconds before the URL is fetched again
+        self._ngrok_conn = None  # Kept-alive connection to the ngrok API
+        self._ngrok_lock = threading.Lock()  # Button callbacks also refresh the display
+        self.url_refresh_interval = 5  # Seconds between status/URL refreshes
+        self._loop = None  # Running event loop, for waking it from button threads
+        self._wake = None  # asyncio.Event set when a button press changes the schedule
         
     def on_button_press(self, button):
         """Handle button press events"""
+        # Any press wakes the screen and restarts the inactivity timer
+        self.display.reset_timeout()
+        self._wake_main_loop()
+        
         if button == "info":
             self.show_recordings_info()
         elif button == "up":
@@ -42,25 +62,57 @@ class AudioPirateApp:
         elif button == "down":
             self.navigate_down()
             
+    def _wake_main_loop(self):
+        """Make the main loop recompute its next deadline (safe from any thread)"""
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._wake.set)
+            except RuntimeError:
+                pass  # Loop already closed during shutdown
+            
+    def _next_deadline(self, last_url_update, now):
+        """Seconds until the next scheduled job: the URL refresh or the screen timeout"""
+        deadline = last_url_update + self.url_refresh_interval - now
+        if self.display.backlight_on:
+            deadline = min(deadline, self.display.last_activity + self.display.timeout_seconds - now)
+        # Never spin: check_timeout() needs the deadline to have strictly passed
+        return max(deadline, 0.01)
+            
     def get_ngrok_url(self):
-        """Get the ngrok public URL from the local API"""
-        try:
-            response = urllib.request.urlopen('http://localhost:4040/api/tunnels', timeout=2)
-            data = json.loads(response.read().decode('utf-8'))
+        """Get the ngrok public URL from the local API (cached for ngrok_cache_ttl seconds)"""
+        # The URL only changes when ngrok restarts, so don't ask on every refresh
+        if self.ngrok_url and time.monotonic() - self._ngrok_fetched_at < self.ngrok_cache_ttl:
+            return self.ngrok_url
+        
+        with self._ngrok_lock:
+            # Another thread may have refreshed it while this one waited
+            if self.ngrok_url and time.monotonic() - self._ngrok_fetched_at < self.ngrok_cache_ttl:
+                return self.ngrok_url
+            
+            try:
+                if self._ngrok_conn is None:
+                    self._ngrok_conn = http.client.HTTPConnection('localhost', 4040, timeout=2)
+                self._ngrok_conn.request('GET', '/api/tunnels')
+                data = json.loads(self._ngrok_conn.getresponse().read())
+            except Exception as e:
+                print(f"Error getting ngrok URL: {e}")
+                if self._ngrok_conn:
+                    self._ngrok_conn.close()
+                    self._ngrok_conn = None
+                return None
+            
+            url = next((t.get('public_url', '') for t in data.get('tunnels', []) if t.get('name') == 'web'), None)
+            if url is not None:
+                # Remove https:// prefix for display
+                if url.startswith('https://'):
+                    url = url[8:]
+                elif url.startswith('http://'):
+                    url = url[7:]
             
-            for tunnel in data.get('tunnels', []):
-                if tunnel.get('name') == 'web':
-                    url = tunnel.get('public_url', '')
-                    # Remove https:// prefix for display
-                    if url.startswith('https://'):
-                        url = url[8:]
-                    elif url.startswith('http://'):
-                        url = url[7:]
-                    return url
-            return None
-        except Exception as e:
-            print(f"Error getting ngrok URL: {e}")
-            return None
+            self.ngrok_url = url
+            self._ngrok_fetched_at = time.monotonic()
+            return url
             
     def show_recordings_info(self):
         """Show information about recordings"""
@@ -107,44 +159,89 @@ class AudioPirateApp:
         self.running = True
         print("AudioPirate App Starting...")
         
-        # Start web server
-        self.web_server.start()
+        if UVLOOP_AVAILABLE:
+            # libuv event loop: C selector and transports for the web,
+            # WebSocket and display tasks
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
         
-        # Start WebSocket server in separate thread
-        ws_thread = threading.Thread(target=self.ws_server.run, daemon=True)
-        ws_thread.start()
+        try:
+            asyncio.run(self._async_main())
+        except KeyboardInterrupt:
+            print("\nShutting down...")
+        finally:
+            self.cleanup()
+            
+    async def _async_main(self):
+        """Run the WebSocket server and the display loop on one event loop"""
+        loop = asyncio.get_running_loop()
         
-        # Initialize display
-        self.display.clear()
-        self.update_display()
+        # Start web and WebSocket servers as tasks on this loop
+        web_task = asyncio.create_task(self.web_server.serve())
+        ws_task = asyncio.create_task(self.ws_server.start())
+        
+        # Initialize display (blocking calls go to the executor so WebSocket I/O keeps flowing)
+        await loop.run_in_executor(None, self.display.clear)
+        await loop.run_in_executor(None, self.update_display)
         
-        last_url_update = 0
+        self._wake = asyncio.Event()
+        self._loop = loop
+        last_url_update = time.monotonic()
         
         try:
             while self.running:
+                now = time.monotonic()
+                
                 # Update display periodically to get latest ngrok URL
-                if time.time() - last_url_update > 5:
-                    self.update_display()
-                    last_url_update = time.time()
+                if now - last_url_update >= self.url_refresh_interval:
+                    await loop.run_in_executor(None, self.update_display)
+                    last_url_update = now = time.monotonic()
                 
                 # Check for display timeout
-                self.display.check_timeout()
+                self.display.check_timeout(now)
                 
-                time.sleep(0.1)
-                
-        except KeyboardInterrupt:
-            print("\nShutting down...")
+                # Sleep until the next job is due or a button press reschedules
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self._next_deadline(last_url_update, now))
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
         finally:
-            self.cleanup()
+            self._loop = None
+            ws_task.cancel()
+            web_task.cancel()
             
     def cleanup(self):
         """Clean up resources"""
+        self.web_server.stop()
         self.buttons.cleanup()
-        self.display.clear()
         self.display.cleanup()
         print("Cleanup complete")
 
 
+def setup_logging():
+    """
+    Route log records through a queue to a listener thread
+    
+    Logging calls then only enqueue the record, so the event loop and the
+    streaming threads never wait on a slow stdout or journald write.
+    
+    Returns:
+        The started QueueListener; stop it to flush on exit
+    """
+    log_queue = queue.SimpleQueue()
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter("%(message)s"))
+    logging.basicConfig(level=logging.INFO, format="%(message)s",
+                        handlers=[logging.handlers.QueueHandler(log_queue)])
+    listener = logging.handlers.QueueListener(log_queue, console)
+    listener.start()
+    return listener
+
+
 if __name__ == "__main__":
-    app = AudioPirateApp()
-    app.run()
+    listener = setup_logging()
+    try:
+        app = AudioPirateApp()
+        app.run()
+    finally:
+        listener.stop()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Shared TLS Context for AudioPirate
+One server SSLContext per certificate, reused by the web and WebSocket servers
+"""
+
+import ssl
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def get_server_context(cert_file, key_file):
+    """
+    Build (once) the server-side SSL context for a certificate
+    
+    Both servers call this with the same certificate, so the key and
+    certificate are loaded and parsed once rather than once per server.
+    
+    Args:
+        cert_file: PEM certificate path
+        key_file: PEM private key path
+        
+    Returns:
+        ssl.SSLContext
+        
+    Raises:
+        OSError, ssl.SSLError: If the certificate can't be loaded
+    """
+    # Server-side defaults: no TLS compression, server cipher preference,
+    # session tickets enabled
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    # The Pi's Cortex-A53 has no AES instructions, so prefer ChaCha20 (TLS 1.2;
+    # TLS 1.3 suites are left to OpenSSL)
+    context.set_ciphers('ECDHE+CHACHA20:ECDHE+AESGCM')
+    context.options |= ssl.OP_NO_COMPRESSION
+    context.load_cert_chain(cert_file, key_file)
+    return context
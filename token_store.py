@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Stream Authentication for AudioPirate
+Password check and thread-safe live stream tokens that expire in order, so the store never grows unbounded
+"""
+
+import hashlib
+import heapq
+import hmac
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PasswordHash:
+    """Salted scrypt key of the stream password, checked in constant time"""
+    
+    # Each check takes ~16MB and tens of ms, so cap how many run at once
+    # however many login requests arrive together
+    _slots = threading.BoundedSemaphore(2)
+    
+    # Async callers verify here rather than tying up the loop's default executor
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='verify')
+    
+    def __init__(self, password):
+        """
+        Args:
+            password: Plain text stream password; only the derived key is kept
+        """
+        self._salt = secrets.token_bytes(16)
+        self._key = self._derive(password)
+    
+    def _derive(self, password):
+        """Derive the 32-byte key for a password (~16MB, tens of ms)"""
+        return hashlib.scrypt(password.encode(), salt=self._salt, n=2**14, r=8, p=1, dklen=32)
+    
+    def verify(self, password):
+        """Return True if the password matches"""
+        with self._slots:
+            key = self._derive(password)
+        return hmac.compare_digest(key, self._key)
+
+
+class TokenStore:
+    """Issued stream tokens with a fixed lifetime"""
+    
+    def __init__(self, lifetime=24 * 60 * 60):
+        """
+        Args:
+            lifetime: Seconds a token stays valid after it is issued
+        """
+        self.lifetime = lifetime
+        self._tokens = {}  # token -> monotonic expiry
+        self._expiry_heap = []  # (expiry, token), soonest first
+        self._lock = threading.Lock()
+    
+    def issue(self):
+        """
+        Create and store a new token
+        
+        Returns:
+            Token string
+        """
+        token = secrets.token_urlsafe(32)
+        now = time.monotonic()
+        expiry = now + self.lifetime
+        with self._lock:
+            self._sweep(now)
+            self._tokens[token] = expiry
+            heapq.heappush(self._expiry_heap, (expiry, token))
+        return token
+    
+    def check(self, token):
+        """Return True if the token was issued and hasn't expired"""
+        now = time.monotonic()
+        with self._lock:
+            # Drop everything that has expired, not just the token asked about
+            self._sweep(now)
+            return self._tokens.get(token, 0) > now
+    
+    def _sweep(self, now):
+        """Forget tokens that expired by now (caller holds the lock)"""
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            _, expired = heapq.heappop(heap)
+            self._tokens.pop(expired, None)
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._tokens)
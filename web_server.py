@@ -5,18 +5,25 @@ Serves recordings directory over HTTP and provides live audio streaming with aut
 """
 
 import os
+import asyncio
 import threading
-import time
 import wave
-import io
 import json
-import secrets
-import hashlib
+import logging
+import queue
 import ssl
 import struct
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+from array import array
+from email.utils import formatdate
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
 from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
 import socket
+from audio_broker import get_broker
+from token_store import PasswordHash, TokenStore
+from tls_context import get_server_context
 
 try:
     import alsaaudio
@@ -24,17 +31,135 @@ try:
 except ImportError:
     ALSA_AVAILABLE = False
 
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+try:
+    from aiohttp import web
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+def _to_s16(data):
+    """Convert native 32-bit samples to 16-bit"""
+    # The high 16 bits of an int32 always fit an int16, so no clamp is needed
+    if NUMPY_AVAILABLE:
+        return (np.frombuffer(data, dtype='<i4') >> 16).astype('<i2').tobytes()
+    # array/memoryview take the chunk as-is: no format string to parse, no *args unpack
+    return array('h', [s >> 16 for s in memoryview(data).cast('i')]).tobytes()
+
+
+def _tune_socket(sock):
+    """
+    Set streaming options on a listening socket; accepted connections inherit them
+    
+    A large send buffer absorbs a client's variable network rate, and
+    keepalive notices dead clients in ~11s instead of hours.
+    """
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)  # Capped by net.core.wmem_max
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, 'TCP_KEEPIDLE'):  # Linux only
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 5)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 2)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+
+
+def _lookup_local_ip():
+    """
+    Find the address clients on the LAN should use (may block on DNS)
+    
+    Returns:
+        IPv4 address string, or "localhost" if none can be found
+    """
+    try:
+        local_ip = socket.getaddrinfo(socket.gethostname(), None, family=socket.AF_INET)[0][4][0]
+    except (socket.gaierror, IndexError):
+        local_ip = None
+    if local_ip is None or local_ip.startswith('127.'):
+        # Debian maps the hostname to 127.0.1.1; ask the routing table instead.
+        # connect() on a UDP socket sends nothing.
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                s.connect(("1.1.1.1", 80))
+                local_ip = s.getsockname()[0]
+        except OSError:
+            pass
+    return local_ip or "localhost"
+
+
+class StreamingHTTPServer(ThreadingHTTPServer):
+    """
+    HTTP server handling requests on a bounded pool of daemon threads
+    
+    Its listening socket carries the streaming socket options. The pool
+    threads are daemons, like ThreadingHTTPServer's own, so an open stream
+    never holds up interpreter exit (ThreadPoolExecutor joins its workers).
+    """
+    
+    max_workers = 32
+    
+    def __init__(self, *args, **kwargs):
+        self.closing = False
+        self._requests = queue.SimpleQueue()
+        self._idle = threading.Semaphore(0)  # Released by a worker each time it finishes
+        self._workers = 0
+        super().__init__(*args, **kwargs)
+    
+    def server_bind(self):
+        _tune_socket(self.socket)
+        super().server_bind()
+    
+    def process_request(self, request, client_address):
+        """Hand the request to an idle pool thread, starting one if none is free"""
+        self._requests.put((request, client_address))
+        # Only the serve_forever thread gets here, so _workers needs no lock
+        if not self._idle.acquire(blocking=False) and self._workers < self.max_workers:
+            self._workers += 1
+            threading.Thread(target=self._work, name=f'http_{self._workers}', daemon=True).start()
+    
+    def _work(self):
+        """Pool thread: handle queued requests until the process exits"""
+        while True:
+            request, client_address = self._requests.get()
+            self.process_request_thread(request, client_address)
+            self._idle.release()
+    
+    def server_close(self):
+        # Open streams notice this flag and end
+        self.closing = True
+        super().server_close()
+
 
 class RecordingsHTTPHandler(SimpleHTTPRequestHandler):
     """Custom HTTP handler for serving recordings and live audio stream"""
     
     # Class-level storage for authentication
-    auth_tokens = {}
+    auth_tokens = TokenStore()
     password_hash = None
     
-    def __init__(self, *args, directory=None, audio_device='mic_with_gain', **kwargs):
+    # (mtime_ns, etag, last_modified, html) of the live page, reloaded when the file changes
+    _live_page_cache = None
+    
+    # Header for the fixed /stream_audio format (48kHz stereo 16-bit, open-ended length)
+    WAV_HEADER_48K_STEREO_S16 = struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 0xFFFFFFFF, b'WAVE',
+        b'fmt ', 16, 1, 2, 48000, 48000 * 4, 4, 16,
+        b'data', 0xFFFFFFFF - 36
+    )
+    
+    def __init__(self, *args, directory=None, audio_device='mic_with_gain', capture=None, **kwargs):
         self.directory = directory
         self.audio_device = audio_device
+        self.capture = capture or get_broker(audio_device)
         super().__init__(*args, directory=directory, **kwargs)
         
     def log_message(self, format, *args):
@@ -77,19 +202,27 @@ class RecordingsHTTPHandler(SimpleHTTPRequestHandler):
         else:
             self.send_error(404, 'Not found')
     
+    @classmethod
+    def token_valid(cls, token):
+        """Check a stream token"""
+        return cls.auth_tokens.check(token)
+    
+    @classmethod
+    def issue_token(cls, password):
+        """
+        Check a password and issue a 24 hour stream token
+        
+        Returns:
+            Token string, or None if the password is wrong
+        """
+        if cls.password_hash is None or not cls.password_hash.verify(password):
+            return None
+        return cls.auth_tokens.issue()
+    
     def check_auth(self):
         """Check if request has valid authentication token"""
-        if '?' in self.path:
-            query = self.path.split('?', 1)[1]
-            params = dict(param.split('=') for param in query.split('&') if '=' in param)
-            token = params.get('token', '')
-            
-            if token in self.auth_tokens:
-                if time.time() < self.auth_tokens[token]:
-                    return True
-                else:
-                    del self.auth_tokens[token]
-        return False
+        params = parse_qs(urlsplit(self.path).query)
+        return self.token_valid(params.get('token', [''])[0])
     
     def handle_authentication(self):
         """Handle password authentication"""
@@ -97,14 +230,9 @@ class RecordingsHTTPHandler(SimpleHTTPRequestHandler):
             content_length = int(self.headers.get('Content-Length', 0))
             body = self.rfile.read(content_length)
             data = json.loads(body)
-            password = data.get('password', '')
-            password_hash = hashlib.sha256(password.encode()).hexdigest()
+            token = self.issue_token(data.get('password', ''))
             
-            if password_hash == self.password_hash:
-                token = secrets.token_urlsafe(32)
-                expiry = time.time() + (24 * 60 * 60)
-                self.auth_tokens[token] = expiry
-                
+            if token:
                 self.send_response(200)
                 self.send_header('Content-Type', 'application/json')
                 self.end_headers()
@@ -120,16 +248,60 @@ class RecordingsHTTPHandler(SimpleHTTPRequestHandler):
             print(f"Authentication error: {e}")
             self.send_error(500, 'Authentication error')
     
+    @classmethod
+    def live_page(cls):
+        """
+        Get the live stream page, rereading it only when its mtime changes
+        
+        Returns:
+            (etag, last_modified, html bytes), or None if the page is missing
+        """
+        html_file = Path(__file__).parent / 'templates' / 'live_stream.html'
+        try:
+            st = html_file.stat()
+        except FileNotFoundError:
+            return None
+        
+        cache = cls._live_page_cache
+        if cache is None or cache[0] != st.st_mtime_ns:
+            cache = (
+                st.st_mtime_ns,
+                f'"{st.st_mtime_ns:x}"',
+                formatdate(st.st_mtime, usegmt=True),
+                html_file.read_bytes(),
+            )
+            cls._live_page_cache = cache
+        return cache[1:]
+    
+    @staticmethod
+    def live_page_unchanged(headers, etag, last_modified):
+        """Return True if the request's validators show the client's copy is current"""
+        if_none_match = headers.get('If-None-Match')
+        if if_none_match is not None:
+            return if_none_match == etag
+        return headers.get('If-Modified-Since') == last_modified
+    
     def serve_live_page(self):
         """Serve the live stream HTML page"""
-        html_file = Path(__file__).parent / 'templates' / 'live_stream.html'
+        page = self.live_page()
         
-        if html_file.exists():
+        if page is not None:
+            etag, last_modified, html = page
+            if self.live_page_unchanged(self.headers, etag, last_modified):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Last-Modified', last_modified)
+                self.end_headers()
+                return
+            
             self.send_response(200)
             self.send_header('Content-type', 'text/html')
+            self.send_header('Content-Length', str(len(html)))
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.send_header('Cache-Control', 'max-age=3600')
             self.end_headers()
-            with open(html_file, 'rb') as f:
-                self.wfile.write(f.read())
+            self.wfile.write(html)
         else:
             self.send_error(404, 'Live stream page not found')
     
@@ -140,83 +312,70 @@ class RecordingsHTTPHandler(SimpleHTTPRequestHandler):
             return
         
         try:
-            # Try the configured device first, fall back to hw:0,0
-            device = self.audio_device
-            try:
-                pcm = alsaaudio.PCM(
-                    alsaaudio.PCM_CAPTURE,
-                    alsaaudio.PCM_NORMAL,
-                    device=device
-                )
-            except alsaaudio.ALSAAudioError:
-                print(f"Device '{device}' not found, falling back to 'hw:0,0'")
-                device = 'hw:0,0'
-                pcm = alsaaudio.PCM(
-                    alsaaudio.PCM_CAPTURE,
-                    alsaaudio.PCM_NORMAL,
-                    device=device
-                )
-            
-            pcm.setchannels(2)
-            pcm.setrate(48000)
-            pcm.setformat(alsaaudio.PCM_FORMAT_S32_LE)  # Read native 32-bit format
-            pcm.setperiodsize(2048)
-            
-            self.send_response(200)
-            self.send_header('Content-Type', 'audio/wav')
-            self.send_header('Cache-Control', 'no-cache')
-            self.send_header('Connection', 'close')
-            self.end_headers()
-            
-            wav_header = self._create_wav_header(48000, 2, 16)  # Stream as 16-bit
-            self.wfile.write(wav_header)
-            
-            print("Starting audio stream (32-bit -> 16-bit conversion)...")
+            # Share the server's capture thread rather than opening the device per client
+            chunks = self.capture.subscribe(transform=_to_s16)
             chunk_count = 0
             try:
-                while True:
-                    length, data = pcm.read()
-                    if length > 0:
-                        # Convert 32-bit samples to 16-bit
-                        samples_32 = struct.unpack(f'{len(data)//4}i', data)
-                        samples_16 = [max(-32768, min(32767, s >> 16)) for s in samples_32]
-                        data_16 = struct.pack(f'{len(samples_16)}h', *samples_16)
-                        
-                        chunk_count += 1
-                        if chunk_count % 50 == 0:  # Log every ~1 second
-                            print(f"Streaming... ({chunk_count} chunks, {len(data_16)} bytes)")
-                        self.wfile.write(data_16)
-                        self.wfile.flush()
+                self.send_response(200)
+                self.send_header('Content-Type', 'audio/wav')
+                self.send_header('Cache-Control', 'no-cache')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                
+                # Chunks are sent in ~16KB batches, the WAV header going out with the first
+                wav_header = self.WAV_HEADER_48K_STEREO_S16  # Stream as 16-bit
+                batch = [wav_header]
+                batched = len(wav_header)
+                
+                print("Starting audio stream (32-bit -> 16-bit conversion)...")
+                while not self.server.closing:
+                    try:
+                        data_16 = chunks.get(timeout=1.0)
+                    except queue.Empty:
+                        continue
+                    if data_16 is None:
+                        break
+                    
+                    chunk_count += 1
+                    if chunk_count % 50 == 0:  # Log every ~1 second
+                        logger.debug("Streaming... (%d chunks, %d bytes)", chunk_count, len(data_16))
+                    batch.append(data_16)
+                    batched += len(data_16)
+                    if batched >= 16384:
+                        self._send_parts(batch)
+                        batch.clear()
+                        batched = 0
+                
+                if batch:
+                    self._send_parts(batch)
             except (BrokenPipeError, ConnectionResetError):
                 print(f"Client disconnected from audio stream after {chunk_count} chunks")
             finally:
-                pcm.close()
+                self.capture.unsubscribe(chunks)
         except alsaaudio.ALSAAudioError as e:
             print(f"ALSA error during streaming: {e}")
             self.send_error(500, f'Audio streaming error: {e}')
         except Exception as e:
             print(f"Error streaming audio: {e}")
     
-    def _create_wav_header(self, sample_rate, channels, bits_per_sample):
-        """Create a WAV file header for streaming"""
-        data_size = 0xFFFFFFFF - 36
-        header = io.BytesIO()
-        header.write(b'RIFF')
-        header.write((data_size + 36).to_bytes(4, 'little'))
-        header.write(b'WAVE')
-        header.write(b'fmt ')
-        header.write((16).to_bytes(4, 'little'))
-        header.write((1).to_bytes(2, 'little'))
-        header.write(channels.to_bytes(2, 'little'))
-        header.write(sample_rate.to_bytes(4, 'little'))
-        byte_rate = sample_rate * channels * bits_per_sample // 8
-        header.write(byte_rate.to_bytes(4, 'little'))
-        block_align = channels * bits_per_sample // 8
-        header.write(block_align.to_bytes(2, 'little'))
-        header.write(bits_per_sample.to_bytes(2, 'little'))
-        header.write(b'data')
-        header.write(data_size.to_bytes(4, 'little'))
-        return header.getvalue()
+    def _send_parts(self, parts):
+        """
+        Send a list of buffers straight to the client socket
+        
+        On a plain socket they go out in one gathered sendmsg() with no
+        join; TLS has to encrypt a contiguous buffer, so they are joined.
+        """
+        if isinstance(self.connection, ssl.SSLSocket):
+            self.connection.sendall(b''.join(parts))
+            return
+        views = [memoryview(part) for part in parts]
+        while views:
+            sent = self.connection.sendmsg(views)
+            # Drop what went out and trim a partly sent buffer
+            while views and sent >= len(views[0]):
+                sent -= len(views.pop(0))
+            if sent:
+                views[0] = views[0][sent:]
 
 
 class WebServer:
@@ -241,6 +400,10 @@ class WebServer:
         self.server = None
         self.thread = None
         self.running = False
+        self.capture = get_broker(audio_device)
+        self._audio_executor = None
+        self._password_hash = PasswordHash(password)  # Derived once; verify() per login
+        self._local_ip = None  # Looked up once when the server starts
         os.makedirs(self.directory, exist_ok=True)
         
     def start(self):
@@ -254,35 +417,23 @@ class WebServer:
             if self.use_ssl:
                 self._ensure_certificates()
             
-            RecordingsHTTPHandler.password_hash = hashlib.sha256(self.password.encode()).hexdigest()
+            RecordingsHTTPHandler.password_hash = self._password_hash
             
             handler = lambda *args, **kwargs: RecordingsHTTPHandler(
-                *args, directory=self.directory, audio_device=self.audio_device, **kwargs
+                *args, directory=self.directory, audio_device=self.audio_device,
+                capture=self.capture, **kwargs
             )
             
-            self.server = HTTPServer(('0.0.0.0', self.port), handler)
+            self.server = StreamingHTTPServer(('0.0.0.0', self.port), handler)
             
             # Wrap with SSL if enabled
             if self.use_ssl:
-                context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-                context.load_cert_chain(self.cert_file, self.key_file)
+                context = get_server_context(self.cert_file, self.key_file)
                 self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
             
             self.running = True
-            
-            hostname = socket.gethostname()
-            try:
-                local_ip = socket.gethostbyname(hostname)
-            except:
-                local_ip = "localhost"
-            
-            protocol = "https" if self.use_ssl else "http"
-            print(f"Web server started at {protocol}://{local_ip}:{self.port}")
-            print(f"Live stream available at {protocol}://{local_ip}:{self.port}/live")
-            print(f"Stream password: {self.password}")
-            if self.use_ssl:
-                print(f"⚠️  Using self-signed certificate - browsers will show security warning")
-            print(f"Serving files from: {self.directory}")
+            self._local_ip = _lookup_local_ip()
+            self._print_banner()
             
             self.thread = threading.Thread(target=self._run_server, daemon=True)
             self.thread.start()
@@ -291,6 +442,141 @@ class WebServer:
             print(f"Port {self.port} may already be in use")
             self.running = False
             
+    async def serve(self):
+        """
+        Serve on the running event loop with aiohttp (blocks until cancelled)
+        
+        Without aiohttp this starts the threaded HTTPServer and returns.
+        """
+        if not AIOHTTP_AVAILABLE:
+            self.start()
+            return
+        if self.running:
+            print("Web server already running")
+            return
+        
+        # Generate SSL certificates if needed
+        if self.use_ssl:
+            self._ensure_certificates()
+        
+        RecordingsHTTPHandler.password_hash = self._password_hash
+        
+        app = web.Application()
+        app.router.add_get('/live', self._handle_live)
+        app.router.add_post('/authenticate', self._handle_authenticate)
+        app.router.add_get('/stream_audio', self._handle_stream_audio)
+        app.router.add_static('/', self.directory, show_index=True)
+        
+        ssl_context = None
+        if self.use_ssl:
+            ssl_context = get_server_context(self.cert_file, self.key_file)
+        
+        # Opening the capture device is kept off the default executor
+        self._audio_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='audio')
+        
+        runner = web.AppRunner(app)
+        await runner.setup()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            _tune_socket(sock)
+            sock.bind(('0.0.0.0', self.port))
+            await web.SockSite(runner, sock, ssl_context=ssl_context).start()
+        except OSError as e:
+            print(f"Failed to start web server: {e}")
+            print(f"Port {self.port} may already be in use")
+            sock.close()
+            await runner.cleanup()
+            self._audio_executor.shutdown(wait=False)
+            return
+        
+        self.running = True
+        self._local_ip = await asyncio.get_running_loop().run_in_executor(None, _lookup_local_ip)
+        self._print_banner()
+        try:
+            await asyncio.Future()  # Run until cancelled
+        finally:
+            await runner.cleanup()
+            self._audio_executor.shutdown(wait=False)
+            self.running = False
+    
+    async def _handle_live(self, request):
+        """Serve the live stream HTML page"""
+        page = RecordingsHTTPHandler.live_page()
+        if page is None:
+            raise web.HTTPNotFound(text='Live stream page not found')
+        
+        etag, last_modified, html = page
+        headers = {'ETag': etag, 'Last-Modified': last_modified, 'Cache-Control': 'max-age=3600'}
+        if RecordingsHTTPHandler.live_page_unchanged(request.headers, etag, last_modified):
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=html, content_type='text/html', headers=headers)
+    
+    async def _handle_authenticate(self, request):
+        """Handle password authentication"""
+        try:
+            data = await request.json()
+            # The scrypt check takes tens of ms, so keep it off the event loop
+            token = await asyncio.get_running_loop().run_in_executor(
+                PasswordHash.executor, RecordingsHTTPHandler.issue_token, data.get('password', '')
+            )
+        except Exception as e:
+            print(f"Authentication error: {e}")
+            raise web.HTTPInternalServerError(text='Authentication error')
+        
+        if token:
+            return web.json_response({'success': True, 'token': token})
+        return web.json_response({'success': False, 'message': 'Invalid password'})
+    
+    async def _handle_stream_audio(self, request):
+        """Stream live audio from microphones"""
+        if not RecordingsHTTPHandler.token_valid(request.query.get('token', '')):
+            raise web.HTTPUnauthorized(text='Unauthorized')
+        if not ALSA_AVAILABLE:
+            raise web.HTTPServiceUnavailable(text='ALSA not available - cannot stream audio')
+        
+        # Blocking ALSA calls run in the audio executor so other requests keep being served
+        loop = asyncio.get_running_loop()
+        try:
+            chunks = await loop.run_in_executor(
+                self._audio_executor, partial(self.capture.subscribe, loop, _to_s16)
+            )
+        except alsaaudio.ALSAAudioError as e:
+            print(f"ALSA error during streaming: {e}")
+            raise web.HTTPInternalServerError(text=f'Audio streaming error: {e}')
+        
+        response = web.StreamResponse(headers={'Content-Type': 'audio/wav', 'Cache-Control': 'no-cache'})
+        chunk_count = 0
+        try:
+            await response.prepare(request)
+            await response.write(RecordingsHTTPHandler.WAV_HEADER_48K_STEREO_S16)  # Stream as 16-bit
+            
+            print("Starting audio stream (32-bit -> 16-bit conversion)...")
+            while True:
+                data_16 = await chunks.get()
+                if data_16 is None:
+                    break
+                
+                chunk_count += 1
+                if chunk_count % 50 == 0:  # Log every ~1 second
+                    logger.debug("Streaming... (%d chunks, %d bytes)", chunk_count, len(data_16))
+                await response.write(data_16)
+        except ConnectionResetError:
+            print(f"Client disconnected from audio stream after {chunk_count} chunks")
+        finally:
+            self.capture.unsubscribe(chunks)
+        return response
+    
+    def _print_banner(self):
+        """Print where the server can be reached"""
+        protocol = "https" if self.use_ssl else "http"
+        print(f"Web server started at {protocol}://{self._local_ip}:{self.port}")
+        print(f"Live stream available at {protocol}://{self._local_ip}:{self.port}/live")
+        print(f"Stream password: {self.password}")
+        if self.use_ssl:
+            print(f"⚠️  Using self-signed certificate - browsers will show security warning")
+        print(f"Serving files from: {self.directory}")
+            
     def _ensure_certificates(self):
         """Generate self-signed SSL certificates if they don't exist"""
         if os.path.exists(self.cert_file) and os.path.exists(self.key_file):
@@ -395,24 +681,22 @@ class WebServer:
     def get_url(self):
         """Get the server URL"""
         if self.running:
-            hostname = socket.gethostname()
-            try:
-                local_ip = socket.gethostbyname(hostname)
-            except:
-                local_ip = "localhost"
             protocol = "https" if self.use_ssl else "http"
-            return f"{protocol}://{local_ip}:{self.port}"
+            return f"{protocol}://{self._local_ip}:{self.port}"
         return None
 
 
 if __name__ == "__main__":
     import time
     server = WebServer(directory="recordings", port=8000, use_ssl=True)
-    server.start()
     try:
         print("Web server running. Press Ctrl+C to stop...")
-        while True:
-            time.sleep(1)
+        if AIOHTTP_AVAILABLE:
+            asyncio.run(server.serve())
+        else:
+            server.start()
+            while True:
+                time.sleep(1)
     except KeyboardInterrupt:
         print("\nShutting down...")
         server.stop()
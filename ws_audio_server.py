@@ -5,12 +5,16 @@ Low-latency real-time audio streaming using WebSocket + Web Audio API
 """
 
 import asyncio
-import struct
 import json
-import hashlib
-import time
-import ssl
+import logging
 import os
+import struct
+import time
+from array import array
+from functools import lru_cache, partial
+from audio_broker import get_broker
+from token_store import PasswordHash, TokenStore
+from tls_context import get_server_context
 
 try:
     import websockets
@@ -27,37 +31,107 @@ except ImportError:
     ALSA_AVAILABLE = False
     print("Warning: alsaaudio not available")
 
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+try:
+    import uvloop
+    UVLOOP_AVAILABLE = True
+except ImportError:
+    UVLOOP_AVAILABLE = False
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = NUMPY_AVAILABLE
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+if NUMBA_AVAILABLE:
+    # fastmath lets LLVM treat the products as never NaN, so min/max lower
+    # straight to fminnm/fmaxnm without NaN-ordering fixups
+    @njit(cache=True, fastmath=True)
+    def _amplify_int32(buf, gain, lim):
+        """Scale int32 samples in place, limited to +/-lim and truncated like int()"""
+        # Branch-free min/max so LLVM can vectorise the loop (NEON fmin/fmax on the Pi)
+        for i in range(buf.shape[0]):
+            buf[i] = int(min(max(buf[i] * gain, -lim), lim))
+
+
+# Constant control messages, serialized once. They stay str so they go out as
+# text frames; the live page treats every binary frame as audio.
+_MSG_AUTH_FAILED = json.dumps({'type': 'auth_failed', 'message': 'Invalid password'})
+_MSG_ALSA_UNAVAILABLE = json.dumps({'type': 'error', 'message': 'ALSA not available'})
+_MSG_TOKEN_EXPIRED = json.dumps({'type': 'error', 'message': 'Token expired'})
+_MSG_INVALID_TOKEN = json.dumps({'type': 'error', 'message': 'Invalid or expired token'})
+_MSG_INVALID_JSON = json.dumps({'type': 'error', 'message': 'Invalid JSON'})
+
+
+@lru_cache(maxsize=None)
+def _audio_config_message(bits_per_sample):
+    """Serialized audio_config message for a stream sample width"""
+    return json.dumps({
+        'type': 'audio_config',
+        'sampleRate': 48000,
+        'channels': 2,
+        'bitsPerSample': bits_per_sample
+    })
+
+
+@lru_cache(maxsize=4)
+def _silence(length):
+    """All-zero chunk of length bytes"""
+    return bytes(length)
+
+
+@lru_cache(maxsize=8)
+def _binary_frame_header(length):
+    """Header of a final binary frame carrying length bytes (server frames are unmasked)"""
+    if length < 126:
+        return struct.pack('!BB', 0x82, length)
+    if length < 65536:
+        return struct.pack('!BBH', 0x82, 126, length)
+    return struct.pack('!BBQ', 0x82, 127, length)
+
 
 class AudioWebSocketServer:
     """WebSocket server for real-time audio streaming"""
     
-    def __init__(self, port=8765, audio_device='hw:0,0', password='audiopirate', use_ssl=True, cert_dir='certs', gain=1.0):
+    def __init__(self, port=8765, audio_device='hw:0,0', password='audiopirate', use_ssl=True, cert_dir='certs', gain=1.0, bits_per_sample=16):
         self.port = port
         self.audio_device = audio_device
-        self.password_hash = hashlib.sha256(password.encode()).hexdigest()
-        self.auth_tokens = {}  # token -> expiry
+        self.password_hash = PasswordHash(password)
+        self.auth_tokens = TokenStore()
         self.server = None
         self.running = False
         self.use_ssl = use_ssl
         self.cert_dir = cert_dir
         self.ssl_context = None
         self.gain = gain  # Software gain multiplier for ADAU7002 (start conservative)
+        self.bits_per_sample = bits_per_sample  # 16 halves the stream; 32 sends the full capture
+        self.batch_periods = 2  # Capture periods per WebSocket frame (20ms each)
+        self.stats_interval = 5  # Seconds between aggregated stream stats
+        self._active_streams = 0
+        self._chunks_sent = 0  # Across all streams; sampled by _stats_loop
+        self._buffers = None  # Encode scratch buffers, see _scratch
         
         print(f"[WebSocket] Server initialized on port {port}")
         
-    async def authenticate(self, websocket, message):
+    async def authenticate(self, websocket, password):
         """Handle authentication request"""
         try:
-            data = json.loads(message)
-            password = data.get('password', '')
-            password_hash = hashlib.sha256(password.encode()).hexdigest()
+            # The scrypt check takes tens of ms, so keep it off the event loop
+            loop = asyncio.get_running_loop()
             
-            if password_hash == self.password_hash:
+            if await loop.run_in_executor(PasswordHash.executor, self.password_hash.verify, password):
                 # Generate token
-                import secrets
-                token = secrets.token_urlsafe(32)
-                expiry = time.time() + (24 * 60 * 60)
-                self.auth_tokens[token] = expiry
+                token = self.auth_tokens.issue()
                 
                 await websocket.send(json.dumps({
                     'type': 'auth_success',
@@ -65,10 +139,7 @@ class AudioWebSocketServer:
                 }))
                 return True
             else:
-                await websocket.send(json.dumps({
-                    'type': 'auth_failed',
-                    'message': 'Invalid password'
-                }))
+                await websocket.send(_MSG_AUTH_FAILED)
                 return False
         except Exception as e:
             print(f"Authentication error: {e}")
@@ -76,101 +147,175 @@ class AudioWebSocketServer:
     
     def check_token(self, token):
         """Verify authentication token"""
-        if token in self.auth_tokens:
-            if time.time() < self.auth_tokens[token]:
-                return True
-            else:
-                del self.auth_tokens[token]
-        return False
+        return self.auth_tokens.check(token)
     
     async def stream_audio(self, websocket, token):
         """Stream audio to authenticated client"""
         if not ALSA_AVAILABLE:
-            await websocket.send(json.dumps({
-                'type': 'error',
-                'message': 'ALSA not available'
-            }))
+            await websocket.send(_MSG_ALSA_UNAVAILABLE)
             return
         
-        # Try configured device first, fall back to hw:0,0
-        device = self.audio_device
-        try:
-            pcm = alsaaudio.PCM(
-                alsaaudio.PCM_CAPTURE,
-                alsaaudio.PCM_NORMAL,
-                device=device
-            )
-        except alsaaudio.ALSAAudioError:
-            print(f"Device '{device}' not found, falling back to 'hw:0,0'")
-            device = 'hw:0,0'
-            pcm = alsaaudio.PCM(
-                alsaaudio.PCM_CAPTURE,
-                alsaaudio.PCM_NORMAL,
-                device=device
-            )
-        
-        # Configure audio
-        pcm.setchannels(2)
-        pcm.setrate(48000)
-        pcm.setformat(alsaaudio.PCM_FORMAT_S32_LE)
-        pcm.setperiodsize(8192)  # Large chunks for stable network streaming (latency not critical)
-        
-        # Send audio config to client
-        await websocket.send(json.dumps({
-            'type': 'audio_config',
-            'sampleRate': 48000,
-            'channels': 2,
-            'bitsPerSample': 32
-        }))
+        # Share one capture of the device with every other listener; the gain
+        # is applied once per chunk in the capture thread, off the event loop
+        loop = asyncio.get_running_loop()
+        broker = get_broker(self.audio_device)
+        chunks = await loop.run_in_executor(None, partial(broker.subscribe, loop, self._encode))
         
-        print(f"Started audio stream for client (device: {device})")
         chunk_count = 0
-        max_sample = 0
-        
         try:
+            # Everything after subscribe sits inside the try so the finally
+            # always unsubscribes, even if the client is already gone
+            self._active_streams += 1
+            
+            # Send audio config to client
+            await websocket.send(_audio_config_message(self.bits_per_sample))
+            
+            print(f"Started audio stream for client (device: {self.audio_device})")
+            
+            send_chunk = self._chunk_sender(websocket)
+            # Bound once rather than looked up on every chunk
+            next_chunk = chunks.get
+            check_token = self.auth_tokens.check
+            batch_periods = self.batch_periods
+            join = b''.join
+            monotonic = time.monotonic
+            next_token_check = 0.0
+            
+            pending = []
             while True:
-                # Check if token is still valid
-                if not self.check_token(token):
-                    await websocket.send(json.dumps({
-                        'type': 'error',
-                        'message': 'Token expired'
-                    }))
+                data = await next_chunk()
+                if data is None:
                     break
                 
-                # Read audio data
-                length, data = pcm.read()
-                if length > 0:
-                    # Apply software gain boost (ADAU7002 has no hardware gain)
-                    import struct
-                    samples = struct.unpack(f'<{len(data)//4}i', data)
-                    
-                    # Amplify by configured gain with simple limiting
-                    max_val = 2147483647
-                    amplified = []
-                    for s in samples:
-                        amplified_sample = int(s * self.gain)
-                        # Simple hard limit to prevent overflow
-                        amplified_sample = max(-max_val, min(max_val, amplified_sample))
-                        amplified.append(amplified_sample)
-                    
-                    data = struct.pack(f'<{len(amplified)}i', *amplified)
-                    
-                    # Send amplified binary data
-                    await websocket.send(data)
-                    chunk_count += 1
-                    
-                    if chunk_count % 100 == 0:
-                        print(f"Streamed {chunk_count} chunks ({len(data)} bytes/chunk)")
+                # Send batch_periods periods per frame: fewer frames, TLS
+                # records and wakeups for 20ms more audio per message
+                pending.append(data)
+                if len(pending) < batch_periods:
+                    continue
+                data = join(pending)
+                pending.clear()
+                
+                # Check if token is still valid, at most once a second: tokens
+                # last hours, and each check takes the store's lock
+                now = monotonic()
+                if now >= next_token_check:
+                    if not check_token(token):
+                        await websocket.send(_MSG_TOKEN_EXPIRED)
+                        break
+                    next_token_check = now + 1.0
                 
-                # Small delay to prevent blocking
-                await asyncio.sleep(0.001)
+                # Send amplified binary data
+                await send_chunk(data)
+                chunk_count += 1
+                self._chunks_sent += 1
                 
-        except websockets.exceptions.ConnectionClosed:
+        except (websockets.exceptions.ConnectionClosed, websockets.exceptions.InvalidState):
+            # _chunk_sender reports a closed socket as InvalidState rather than ConnectionClosed
             print(f"Client disconnected after {chunk_count} chunks")
         except Exception as e:
             print(f"Streaming error: {e}")
         finally:
-            pcm.close()
+            self._active_streams -= 1
+            broker.unsubscribe(chunks)
+    
+    @staticmethod
+    def _chunk_sender(websocket):
+        """
+        Return a coroutine function that sends one chunk as a binary frame
+        
+        Every chunk is one complete, uncompressed frame, so where the protocol
+        exposes its transport the header and payload are handed over as two
+        buffers. That skips building a Frame and copying the payload into
+        serialize()'s output, and lets the transport scatter-gather them.
+        """
+        transport = getattr(websocket, 'transport', None)
+        if transport is None or not hasattr(websocket, 'drain') or websocket.extensions:
+            return websocket.send
+        
+        async def send_chunk(data):
+            if not websocket.open:
+                raise websockets.exceptions.InvalidState("WebSocket is not open")
+            transport.writelines((_binary_frame_header(len(data)), data))
+            await websocket.drain()  # Flow control, as write_frame does
+        
+        return send_chunk
+    
+    def _encode(self, data):
+        """Apply gain and narrow the chunk to the configured sample width"""
+        gain = self.gain
+        if gain == 0.0:
+            # Muted: every chunk of a given size is the same silence
+            return _silence(len(data) * self.bits_per_sample // 32)
+        
+        if gain == 1.0:
+            # Unity gain is the identity, so skip the gain pass and its copy
+            if self.bits_per_sample == 32:
+                return data
+            samples = np.frombuffer(data, dtype='<i4') if NUMPY_AVAILABLE else memoryview(data).cast('i')
+        else:
+            samples = self._apply_gain(data)
+        if self.bits_per_sample == 32:
+            return samples.tobytes()
+        
+        # The gain limit keeps every sample in int32 range, so the arithmetic
+        # shift alone leaves the high 16 bits with nothing to saturate
+        if NUMPY_AVAILABLE:
+            pcm16 = self._scratch(len(samples))[2]
+            np.right_shift(samples, 16, out=pcm16, casting='same_kind')
+            return pcm16.tobytes()
+        return array('h', [s >> 16 for s in samples]).tobytes()
+    
+    def _scratch(self, count):
+        """
+        Return the reusable int32, float64 and int16 work buffers for count samples
+        
+        Only the capture thread encodes, so one set per server is enough. The
+        buffers grow to the largest chunk seen and are sliced for shorter reads.
+        """
+        if self._buffers is None or len(self._buffers[0]) < count:
+            self._buffers = (
+                np.empty(count, dtype='<i4'),
+                np.empty(count, dtype=np.float64),
+                np.empty(count, dtype='<i2'),
+            )
+        return tuple(b[:count] for b in self._buffers)
+    
+    def _apply_gain(self, data):
+        """
+        Apply software gain boost (ADAU7002 has no hardware gain)
+        
+        Returns:
+            The amplified native-order int32 samples; with NumPy these are a
+            view of a scratch buffer that the next chunk overwrites
+        """
+        max_val = 2147483647
+        
+        if NUMPY_AVAILABLE:
+            # Copy into the reused scratch buffer instead of a fresh array per chunk
+            samples, amplified, _ = self._scratch(len(data) // 4)
+            np.copyto(samples, np.frombuffer(data, dtype='<i4'))
+            
+            if NUMBA_AVAILABLE:
+                # One pass in place, no float64 temporary
+                _amplify_int32(samples, float(self.gain), max_val)
+                return samples
+            
+            # Same float multiply, limit and truncation as the loop below, in C
+            np.multiply(samples, float(self.gain), out=amplified)
+            np.clip(amplified, -max_val, max_val, out=amplified)
+            samples[:] = amplified  # Truncates toward zero like int()
+            return samples
+        
+        # Native-order int view of one mutable copy; S32_LE matches the Pi's byte order
+        samples = memoryview(bytearray(data)).cast('i')
+        gain = self.gain
+        
+        # Amplify by configured gain with simple limiting
+        for i in range(len(samples)):
+            # Simple hard limit to prevent overflow
+            samples[i] = max(-max_val, min(max_val, int(samples[i] * gain)))
+        
+        return samples
     
     def _create_ssl_context(self):
         """Create SSL context for WSS connections"""
@@ -198,9 +343,7 @@ class AudioWebSocketServer:
             return None
         
         try:
-            ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-            ssl_context.load_cert_chain(cert_file, key_file)
-            return ssl_context
+            return get_server_context(cert_file, key_file)
         except Exception as e:
             print(f"[WebSocket] Error loading SSL certificates: {e}")
             return None
@@ -208,43 +351,51 @@ class AudioWebSocketServer:
     async def handler(self, websocket, path):
         """Handle WebSocket connections"""
         print(f"[WebSocket] Client connected from {websocket.remote_address}, path: {path}")
-        token = None
         
         try:
             async for message in websocket:
-                # Check if it's binary (shouldn't receive binary from client)
+                # Control frames are a 1-byte opcode followed by the payload:
+                # b'A' + password authenticates, b'S' + token starts the stream.
+                # Sent as binary, they skip websockets' UTF-8 validation of text frames
                 if isinstance(message, bytes):
-                    continue
+                    message = message.decode('utf-8', 'replace')
+                opcode = message[:1]
                 
-                # Parse JSON message
-                try:
-                    data = json.loads(message)
-                    msg_type = data.get('type', '')
-                    
-                    if msg_type == 'authenticate':
-                        if await self.authenticate(websocket, message):
-                            # Authentication successful, wait for stream request
-                            pass
-                    
-                    elif msg_type == 'start_stream':
-                        token = data.get('token', '')
-                        if self.check_token(token):
-                            await self.stream_audio(websocket, token)
-                        else:
-                            await websocket.send(json.dumps({
-                                'type': 'error',
-                                'message': 'Invalid or expired token'
-                            }))
-                    
-                except json.JSONDecodeError:
-                    await websocket.send(json.dumps({
-                        'type': 'error',
-                        'message': 'Invalid JSON'
-                    }))
+                if opcode == 'A':
+                    await self.authenticate(websocket, message[1:])
+                
+                elif opcode == 'S':
+                    await self.start_stream(websocket, message[1:])
+                
+                elif message.lstrip()[:1] == '{':
+                    # JSON messages from older clients (json.loads allows leading whitespace)
+                    try:
+                        data = json.loads(message)
+                        msg_type = data.get('type', '')
+                        
+                        if msg_type == 'authenticate':
+                            await self.authenticate(websocket, data.get('password', ''))
+                        
+                        elif msg_type == 'start_stream':
+                            await self.start_stream(websocket, data.get('token', ''))
+                        
+                    except json.JSONDecodeError:
+                        await websocket.send(_MSG_INVALID_JSON)
+                
+                else:
+                    # Neither an opcode nor JSON; old servers answered this as bad JSON
+                    await websocket.send(_MSG_INVALID_JSON)
                     
         except Exception as e:
             print(f"Handler error: {e}")
     
+    async def start_stream(self, websocket, token):
+        """Start streaming if the token is valid"""
+        if self.check_token(token):
+            await self.stream_audio(websocket, token)
+        else:
+            await websocket.send(_MSG_INVALID_TOKEN)
+    
     async def process_request(self, path, request_headers):
         """
         Process HTTP requests before WebSocket upgrade.
@@ -261,6 +412,9 @@ class AudioWebSocketServer:
             return
         
         self.running = True
+        if NUMBA_AVAILABLE:
+            # Compile (or load from cache) the gain kernel now rather than on the first chunk
+            await asyncio.get_running_loop().run_in_executor(None, self._apply_gain, bytes(8))
         try:
             # Setup SSL if enabled
             if self.use_ssl:
@@ -278,8 +432,9 @@ class AudioWebSocketServer:
                 self.port,
                 ssl=self.ssl_context if self.use_ssl else None,
                 compression=None,  # Disable compression for ngrok compatibility
-                ping_interval=20,  # Keep connection alive
-                ping_timeout=20,
+                max_size=65536,  # Clients only send short control messages
+                ping_interval=5,  # Notice dead clients within seconds
+                ping_timeout=5,
                 process_request=self.process_request  # Handle HTTP health checks
             )
             
@@ -287,12 +442,27 @@ class AudioWebSocketServer:
             print(f"WebSocket server started on {protocol}://0.0.0.0:{self.port}")
             print("Waiting for connections...")
             
-            await asyncio.Future()  # Run forever
+            stats_task = asyncio.create_task(self._stats_loop())
+            try:
+                await asyncio.Future()  # Run forever
+            finally:
+                stats_task.cancel()
         except Exception as e:
             print(f"WebSocket server error: {e}")
             import traceback
             traceback.print_exc()
     
+    async def _stats_loop(self):
+        """Log aggregated streaming stats every stats_interval seconds"""
+        last_sent = self._chunks_sent
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            sent = self._chunks_sent
+            if sent != last_sent or self._active_streams:
+                logger.info("%d active stream(s), %d chunks sent in the last %gs",
+                            self._active_streams, sent - last_sent, self.stats_interval)
+            last_sent = sent
+    
     def run(self):
         """Run the server (blocking) - thread-safe"""
         if not WEBSOCKETS_AVAILABLE:
@@ -302,8 +472,8 @@ class AudioWebSocketServer:
         
         print(f"[WebSocket] Starting server thread...")
         try:
-            # Create new event loop for this thread
-            loop = asyncio.new_event_loop()
+            # Create new event loop for this thread, on libuv when uvloop is installed
+            loop = uvloop.new_event_loop() if UVLOOP_AVAILABLE else asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
             print(f"[WebSocket] Event loop created")
             loop.run_until_complete(self.start())